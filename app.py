@@ -2,6 +2,7 @@ import streamlit as st
 import os
 from assembler import parse_assembly
 from riscv_core import RiscVCore
+from metrics import METRICS
 from riscv_defs import ABI_NAMES, ABI_TO_INDEX, disassemble
 from instruction_examples import *
 
@@ -41,6 +42,7 @@ Welcome to RISC-V Simulator by Salik Javid! This is an interactive tool for writ
 2.  **Load an Example:** Alternatively, expand "Show References and Examples" to load a pre-written program.
 3.  **Assemble & Load:** Click the `▶️ Assemble & Load` button. This converts your assembly into machine code and loads it into the instruction memory.
 4.  **Control Execution:**
+    * `⏪ Back`: Undo the last executed instruction (reverse execution).
     * `⏯️ Step`: Execute one instruction at a time.
     * `⏩ Run to End`: Execute the program until it halts or hits the cycle limit.
     * `🔄 Reset`: Reset the processor and memory to the initial state.
@@ -61,8 +63,9 @@ def get_reg_group_class(reg_index):
     if reg_index in range(10, 18): return "group-args"
     return ""
 
-def generate_mem_view(title, memory_bytes, start, length, words_per_row=2, highlights=None, layout='row'):
+def generate_mem_view(title, core, start, length, words_per_row=2, highlights=None, layout='row'):
     if highlights is None: highlights = {}
+    words = core.mem_words(start, length, signed=True)
     html = f'<h4>{title}</h4><div class="mem-view">'
     words_in_view = length // 4
     num_rows = (words_in_view + words_per_row - 1) // words_per_row
@@ -72,11 +75,11 @@ def generate_mem_view(title, memory_bytes, start, length, words_per_row=2, highl
         for c in range(words_per_row):
             word_index = (c * num_rows + r) if layout == 'col' else (r * words_per_row + c)
             addr = start + word_index * 4
-            if word_index >= words_in_view or addr + 4 > len(memory_bytes):
+            if word_index >= words_in_view or word_index >= len(words):
                 html += '<div class="mem-word-box empty-box" style="opacity:0.3; border:1px dashed #444;"></div>'
                 continue
 
-            val = int.from_bytes(memory_bytes[addr:addr+4], 'little', signed=True)
+            val = words[word_index]
             hex_val = val & 0xFFFFFFFF
             classes = ["mem-word-box"]
             if val != 0: classes.append("mem-nonzero")
@@ -95,6 +98,7 @@ def generate_mem_view(title, memory_bytes, start, length, words_per_row=2, highl
     return html + '</div>'
 
 # --- 4. LOGIC & STATE MANAGEMENT ---
+if 'metrics_session' not in st.session_state: st.session_state.metrics_session = METRICS.track_session()
 if 'core' not in st.session_state: st.session_state.core = None
 if 'program_info' not in st.session_state: st.session_state.program_info = None
 if 'assembly_code' not in st.session_state: st.session_state.assembly_code = "addi t0, x0, 10"
@@ -105,6 +109,7 @@ def assemble_and_load():
         st.session_state.program_info = {'program': program_info, 'log': expansion_log}
         core = RiscVCore()
         core.load_program(program_info['machine_code'])
+        core.enable_undo()
         st.session_state.core = core
         st.success("Successfully Assembled!")
     except Exception as e:
@@ -117,14 +122,20 @@ with st.sidebar:
     if st.button("▶️ Assemble & Load", use_container_width=True, type="primary"):
         assemble_and_load()
     
-    col1, col2 = st.columns(2)
-    if col1.button("⏯️ Step", use_container_width=True, disabled=st.session_state.core is None):
-        st.session_state.core.step()
-    if col2.button("🔄 Reset", use_container_width=True, disabled=st.session_state.core is None):
+    col1, col2, col3 = st.columns(3)
+    if col1.button("⏪ Back", use_container_width=True, disabled=st.session_state.core is None):
+        st.session_state.core.step_back()
+    if col2.button("⏯️ Step", use_container_width=True, disabled=st.session_state.core is None):
+        cycles_before = st.session_state.core.cycles
+        st.session_state.core.step() # Returns False after retiring an idle-halting instruction, so count cycles
+        METRICS.record_steps(st.session_state.core.cycles - cycles_before)
+    if col3.button("🔄 Reset", use_container_width=True, disabled=st.session_state.core is None):
         st.session_state.core.reset()
         
     if st.button("⏩ Run to End", use_container_width=True, disabled=st.session_state.core is None):
         st.session_state.core.run()
+    if st.session_state.core is not None and st.session_state.core.halt_reason:
+        st.caption(f"Halted: `{st.session_state.core.halt_reason}` after {st.session_state.core.cycles} cycles")
 
     st.divider()
     st.subheader("Quick Examples")
@@ -141,6 +152,23 @@ with st.sidebar:
     with st.popover("📜 Instruction Set Summary", use_container_width=True):
         st.markdown(INSTRUCTION_SUMMARY_MD)
 
+    with st.expander("📊 Simulator Metrics"):
+        snap = METRICS.snapshot()
+        counters, gauges, hists = snap['counters'], snap['gauges'], snap['histograms']
+        m1, m2 = st.columns(2)
+        m1.metric("Instr. retired", f"{counters['instructions_retired_total']:,}")
+        m2.metric("Avg instr. / sec", f"{gauges['instructions_per_second']:,.0f}")
+        m1.metric("Active sessions", gauges['active_sessions'])
+        m2.metric("Core memory", f"{sum(gauges['core_memory_bytes'].values()) / 1024:,.1f} KiB")
+        m1.metric("Programs assembled", counters['assembled_programs_total'])
+        m2.metric("Lines assembled", f"{counters['assembled_lines_total']:,}")
+        for name, label in (('parse_seconds', "Parse"), ('reset_seconds', "Reset"), ('load_seconds', "Load")):
+            h = hists[name]
+            avg_ms = h['sum'] / h['count'] * 1000 if h['count'] else 0.0
+            st.caption(f"{label}: {h['count']} calls, avg {avg_ms:.3f} ms")
+        st.download_button("Prometheus", METRICS.to_prometheus(), file_name="riscv_metrics.prom", use_container_width=True)
+        st.download_button("JSON snapshot", METRICS.to_json(), file_name="riscv_metrics.json", use_container_width=True)
+
 # --- 6. MAIN UI ---
 st.title("RISC-V Simulator by Salik Javid")
 
@@ -170,11 +198,11 @@ with hardware_col:
         
         st.divider()
         mc_len = len(st.session_state.program_info['program']['machine_code']) * 4
-        st.markdown(generate_mem_view("Instruction Memory", core.mem, 0, mc_len, words_per_row=1, highlights={core.pc: "pc-highlight"}), unsafe_allow_html=True)
+        st.markdown(generate_mem_view("Instruction Memory", core, 0, mc_len, words_per_row=1, highlights={core.pc: "pc-highlight"}), unsafe_allow_html=True)
         
         sp_val = core.regs[ABI_TO_INDEX['sp']]
-        st.markdown(generate_mem_view("Stack Memory", core.mem, max(0, sp_val-16), 32, words_per_row=1, highlights={sp_val: "sp-highlight"}, layout='col'), unsafe_allow_html=True)
+        st.markdown(generate_mem_view("Stack Memory", core, max(0, sp_val-16), 32, words_per_row=1, highlights={sp_val: "sp-highlight"}, layout='col'), unsafe_allow_html=True)
         
-        st.markdown(generate_mem_view("Data Memory", core.mem, 512, 64, words_per_row=2), unsafe_allow_html=True)
+        st.markdown(generate_mem_view("Data Memory", core, 512, 64, words_per_row=2), unsafe_allow_html=True)
     else:
         st.info("Assemble & Load a program to see the CPU state.")
\ No newline at end of file
@@ -1,7 +1,9 @@
 # Converts assembly code to machine code for simulation of RV32I.
 # assembler.py
 import re
+import time
 from riscv_defs import *
+from metrics import METRICS
 
 def parse_register(reg_str):
     if reg_str in ABI_TO_INDEX: return ABI_TO_INDEX[reg_str]
@@ -9,6 +11,7 @@ def parse_register(reg_str):
     raise ValueError(f"Invalid register name: {reg_str}")
 
 def parse_assembly(assembly_text):
+    start_time = time.perf_counter()
     source_lines = [line.split('#')[0].strip().lower() for line in assembly_text.strip().split('\n')]
 
     # --- PASS 1: Build Symbol Table ---
@@ -103,4 +106,5 @@ def parse_assembly(assembly_text):
             disassembly[current_address] = original_line
             current_address += 4
 
-    return {'machine_code': machine_code, 'disassembly': disassembly}, expansion_log
\ No newline at end of file
+    METRICS.record_parse(len(source_lines), time.perf_counter() - start_time)
+    return {'machine_code': machine_code, 'disassembly': disassembly, 'symbols': symbol_table}, expansion_log
\ No newline at end of file
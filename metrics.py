@@ -0,0 +1,137 @@
+# metrics.py
+# Process-wide simulator metrics, exportable as Prometheus text or JSON.
+# Nothing here runs per instruction: RiscVCore.run() reports once per call,
+# and callers that use step() directly report their batch with record_steps().
+import json
+import threading
+import time
+import weakref
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+COUNTERS = {
+    'instructions_retired_total': "Instructions retired by RiscVCore.run(), single steps and undo replays.",
+    'run_instructions_total': "Instructions retired inside RiscVCore.run().",
+    'run_seconds_total': "Wall-clock seconds spent inside RiscVCore.run().",
+    'assembled_programs_total': "Successful parse_assembly() calls.",
+    'assembled_lines_total': "Source lines processed by parse_assembly().",
+    'sessions_total': "App sessions started.",
+}
+HISTOGRAMS = {
+    'parse_seconds': "parse_assembly() latency in seconds.",
+    'reset_seconds': "RiscVCore.reset() latency in seconds.",
+    'load_seconds': "RiscVCore.load_program() latency in seconds.",
+}
+GAUGES = {
+    'instructions_per_second': "Lifetime average of simulated instructions per wall-clock second of run().",
+    'active_cores': "RiscVCore instances currently alive.",
+    'active_sessions': "App sessions currently alive.",
+    'core_memory_bytes': "Guest memory plus undo log bytes of each live core, labelled by core id.",
+}
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets) # Non-cumulative; cumulated on export
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        cumulative, total = {}, 0
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            cumulative[str(bound)] = total
+        cumulative['+Inf'] = self.count
+        return {'buckets': cumulative, 'count': self.count, 'sum': self.sum}
+
+class _SessionToken:
+    """Kept in a session's state; the session counts as active until it is garbage collected."""
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock() # Streamlit serves sessions from several threads
+        self.counters = {name: 0 for name in COUNTERS}
+        self.histograms = {name: Histogram() for name in HISTOGRAMS}
+        self._cores = weakref.WeakKeyDictionary() # core -> id used as its metric label
+        self._next_core_id = 0
+        self._sessions = weakref.WeakSet()
+
+    def track_core(self, core):
+        with self._lock:
+            self._cores[core] = self._next_core_id
+            self._next_core_id += 1
+
+    def track_session(self):
+        """Returns a token to store in the session; the session stays active while it lives."""
+        token = _SessionToken()
+        with self._lock:
+            self._sessions.add(token)
+            self.counters['sessions_total'] += 1
+        return token
+
+    def observe(self, name, seconds):
+        with self._lock: self.histograms[name].observe(seconds)
+
+    def record_run(self, instructions, seconds):
+        with self._lock:
+            self.counters['instructions_retired_total'] += instructions
+            self.counters['run_instructions_total'] += instructions
+            self.counters['run_seconds_total'] += seconds
+
+    def record_steps(self, instructions):
+        """Counts instructions retired through RiscVCore.step() outside of run()."""
+        with self._lock: self.counters['instructions_retired_total'] += instructions
+
+    def record_parse(self, lines, seconds):
+        with self._lock:
+            self.counters['assembled_programs_total'] += 1
+            self.counters['assembled_lines_total'] += lines
+            self.histograms['parse_seconds'].observe(seconds)
+
+    def snapshot(self):
+        """Returns all metrics as a plain dict; gauges are computed now from live objects."""
+        with self._lock:
+            cores = list(self._cores.items())
+            footprints = {str(core_id): len(c.mem) + (c.undo_log.nbytes if c.undo_log is not None else 0) for c, core_id in cores}
+            run_seconds = self.counters['run_seconds_total']
+            gauges = {
+                'instructions_per_second': self.counters['run_instructions_total'] / run_seconds if run_seconds else 0.0,
+                'active_cores': len(cores),
+                'active_sessions': len(self._sessions),
+                'core_memory_bytes': footprints,
+            }
+            return {
+                'timestamp': time.time(),
+                'counters': dict(self.counters),
+                'gauges': gauges,
+                'histograms': {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix='riscv_'):
+        """Renders the snapshot in the Prometheus text exposition format."""
+        snap, lines = self.snapshot(), []
+        for kind, helps, values in (('counter', COUNTERS, snap['counters']), ('gauge', GAUGES, snap['gauges'])):
+            for name, value in values.items():
+                lines += [f"# HELP {prefix}{name} {helps[name]}", f"# TYPE {prefix}{name} {kind}"]
+                if isinstance(value, dict): # One series per core
+                    lines += [f'{prefix}{name}{{core="{core_id}"}} {v}' for core_id, v in value.items()]
+                else:
+                    lines.append(f"{prefix}{name} {value}")
+        for name, h in snap['histograms'].items():
+            lines += [f"# HELP {prefix}{name} {HISTOGRAMS[name]}", f"# TYPE {prefix}{name} histogram"]
+            lines += [f'{prefix}{name}_bucket{{le="{le}"}} {n}' for le, n in h['buckets'].items()]
+            lines += [f"{prefix}{name}_sum {h['sum']}", f"{prefix}{name}_count {h['count']}"]
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
@@ -0,0 +1,145 @@
+# multi_hart.py
+# Runs several RV32I harts in worker processes over one shared guest memory.
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+from riscv_core import RiscVCore
+from riscv_defs import ABI_TO_INDEX
+
+class Hart(RiscVCore):
+    """A RiscVCore with its own registers and PC whose memory is a shared buffer.
+
+    The core has no CSR instructions, so the hart id is handed to the guest
+    in a0 at reset (in place of mhartid). Idle detection is off: another hart
+    can change memory that this hart's spin loop is waiting on.
+    """
+    def __init__(self, mem, hartid, sp=None):
+        self.hartid = hartid # Needed by reset(), which the base constructor calls
+        self.initial_sp = sp
+        super().__init__(detect_idle=False, mem=mem)
+
+    def reset(self):
+        """Resets registers only; the shared memory belongs to the whole system."""
+        self._reset_state()
+        self.regs[ABI_TO_INDEX['a0']] = self.hartid
+        if self.initial_sp is not None: self.regs[ABI_TO_INDEX['sp']] = self.initial_sp
+
+def _hart_worker(shm_name, mem_size, hartid, num_harts, sp, max_cycles, quantum, deterministic, sync, results):
+    barrier, cond, turn, stop, done = sync
+    shm = shared_memory.SharedMemory(name=shm_name) # Attach our own mapping; a forked parent's views can't be closed here
+    mem = shm.buf[:mem_size]
+    core = Hart(mem, hartid, sp)
+    finished = False
+
+    def run_quantum():
+        nonlocal finished
+        if finished: return
+        core.run(min(quantum, max_cycles - core.cycles))
+        finished = core.halt_reason is not None or core.cycles >= max_cycles
+        done[hartid] = finished
+
+    if deterministic:
+        # Round-robin token: exactly one hart runs a quantum at a time, always in hart order
+        while True:
+            with cond:
+                while turn.value != hartid: cond.wait()
+                if not stop.value:
+                    run_quantum()
+                    if all(done): stop.value = 1
+                turn.value = (hartid + 1) % num_harts
+                cond.notify_all()
+                if stop.value: break
+    else:
+        # Free-running: harts execute a quantum in parallel, then sync at the barrier
+        while True:
+            run_quantum()
+            barrier.wait()
+            all_done = all(done) # Flags are stable until everyone passes the second barrier
+            barrier.wait()
+            if all_done: break
+
+    results.put((hartid, {'pc': core.pc, 'regs': list(core.regs), 'cycles': core.cycles, 'halt_reason': core.halt_reason}))
+    core.mem = None
+    mem.release()
+    shm.close()
+
+class MultiHartSystem:
+    """Several harts sharing one guest memory placed in multiprocessing.shared_memory.
+
+    Each hart runs in its own process. Plain RV32I has no atomics, so guest
+    code must synchronise through ordinary loads and stores.
+    """
+    def __init__(self, num_harts=2, mem_size=4096):
+        if num_harts < 1: raise ValueError(f"num_harts must be at least 1, got {num_harts}")
+        self.num_harts = num_harts
+        self.mem_size = mem_size
+        self.shm = shared_memory.SharedMemory(create=True, size=mem_size)
+        self.mem = self.shm.buf[:mem_size] # The OS may round the segment up to a page
+        self.loaded_program_mc = []
+        self.results = []
+
+    def load_program(self, machine_code):
+        """Loads machine code into the shared memory (clearing it) and keeps a backup for resets."""
+        self._check_open()
+        self.loaded_program_mc = machine_code
+        Hart(self.mem, 0).load_program(machine_code)
+
+    def reset(self):
+        """Reloads the program into shared memory and forgets the last run's results."""
+        self.load_program(self.loaded_program_mc)
+        self.results = []
+
+    def run(self, max_cycles=5000, quantum=1000, deterministic=False, stack_top=None, stack_size=256):
+        """Runs every hart from PC 0 for at most max_cycles each; returns per-hart results.
+
+        Harts sync every quantum instructions. With deterministic=True they
+        take turns in hart order, so shared-memory races resolve identically
+        on every run. If stack_top is given, hart i starts with
+        sp = stack_top - i * stack_size.
+        Raises RuntimeError if a worker process dies before reporting.
+        """
+        self._check_open()
+        if quantum < 1: raise ValueError(f"quantum must be at least 1, got {quantum}")
+        ctx = mp.get_context()
+        sync = (ctx.Barrier(self.num_harts), ctx.Condition(), ctx.Value('i', 0, lock=False),
+                ctx.Value('b', 0, lock=False), ctx.Array('b', self.num_harts, lock=False))
+        results = ctx.Queue()
+        workers = []
+        for hartid in range(self.num_harts):
+            sp = None if stack_top is None else stack_top - hartid * stack_size
+            args = (self.shm.name, self.mem_size, hartid, self.num_harts, sp, max_cycles, quantum, deterministic, sync, results)
+            workers.append(ctx.Process(target=_hart_worker, args=args, daemon=True))
+        for w in workers: w.start()
+        collected = {}
+        while len(collected) < len(workers): # Drain before join so no worker blocks on the queue
+            try:
+                hartid, result = results.get(timeout=0.1)
+                collected[hartid] = result
+            except queue.Empty:
+                # A dead hart would leave the others waiting at the barrier forever
+                failed = [(i, w.exitcode) for i, w in enumerate(workers) if w.exitcode not in (None, 0)]
+                if failed:
+                    for w in workers:
+                        if w.is_alive(): w.terminate()
+                    for w in workers: w.join()
+                    raise RuntimeError(f"hart worker(s) exited without reporting (hart, exit code): {failed}")
+        for w in workers: w.join()
+        self.results = [collected[i] for i in range(self.num_harts)]
+        return self.results
+
+    def _check_open(self):
+        if self.shm is None: raise ValueError("MultiHartSystem is closed")
+
+    def close(self):
+        """Releases and unlinks the shared memory segment."""
+        if self.shm is None: return
+        self.mem.release()
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
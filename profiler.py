@@ -0,0 +1,82 @@
+# profiler.py
+# Sampling call-stack profiler for guest code running on RiscVCore.
+from bisect import bisect_right
+
+class CallStackProfiler:
+    """Rebuilds the guest call stack from calls and returns, sampling it every N instructions.
+
+    A call is `jal`/`jalr` with rd=ra and a return is `ret` (`jalr zero, ra, 0`);
+    RiscVCore reports both while a profiler is attached. Sampling happens
+    between chunks of RiscVCore.run(), so the step loop only pays for a check
+    on jumps. Each sample is weighted by the cycles executed since the
+    previous one. Frames are named after the nearest assembler label at or
+    before the frame's entry address.
+    """
+    def __init__(self, symbols=None, interval=1000):
+        if interval < 1: raise ValueError(f"interval must be at least 1, got {interval}")
+        self.interval = interval
+        labels = sorted((addr, name) for name, addr in (symbols or {}).items())
+        self._label_addrs = [addr for addr, _ in labels]
+        self._label_names = [name for _, name in labels]
+        self.stack = []   # Entry addresses of the active frames, outermost first
+        self.samples = {} # Tuple of frame entry addresses -> sampled cycles
+
+    def on_call(self, target):
+        self.stack.append(target)
+
+    def on_return(self):
+        if len(self.stack) > 1: self.stack.pop() # Never pop the root frame
+
+    def label(self, addr):
+        i = bisect_right(self._label_addrs, addr) - 1
+        if i < 0: return f"0x{addr:x}"
+        offset = addr - self._label_addrs[i]
+        return self._label_names[i] if offset == 0 else f"{self._label_names[i]}+0x{offset:x}"
+
+    def run(self, core, max_cycles=5000):
+        """Runs the core for up to max_cycles under the profiler; returns its halt_reason."""
+        if not self.stack: self.stack = [core.pc]
+        core.profiler, halt_reason = self, None
+        try:
+            end = core.cycles + max_cycles
+            while core.cycles < end:
+                before = core.cycles
+                halt_reason = core.run(min(self.interval, end - core.cycles))
+                key = tuple(self.stack)
+                self.samples[key] = self.samples.get(key, 0) + (core.cycles - before)
+                if halt_reason is not None: break
+        finally:
+            core.profiler = None
+        return halt_reason
+
+    def _labelled_samples(self):
+        for key, cycles in self.samples.items():
+            if cycles: yield [self.label(addr) for addr in key], cycles
+
+    def collapsed(self):
+        """Returns the samples in collapsed-stack format ("outer;inner cycles" per line), as read by flamegraph.pl."""
+        merged = {}
+        for frames, cycles in self._labelled_samples():
+            stack = ';'.join(frames)
+            merged[stack] = merged.get(stack, 0) + cycles
+        return ''.join(f"{stack} {cycles}\n" for stack, cycles in sorted(merged.items()))
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
+
+    def table(self):
+        """Returns (function, inclusive cycles, exclusive cycles) rows, most expensive first."""
+        inclusive, exclusive = {}, {}
+        for frames, cycles in self._labelled_samples():
+            exclusive[frames[-1]] = exclusive.get(frames[-1], 0) + cycles
+            for name in set(frames): # Count recursive frames once
+                inclusive[name] = inclusive.get(name, 0) + cycles
+        return sorted(((name, incl, exclusive.get(name, 0)) for name, incl in inclusive.items()), key=lambda row: (-row[1], row[0]))
+
+    def format_table(self):
+        total = sum(self.samples.values()) or 1
+        lines = [f"{'function':<24} {'inclusive':>12} {'incl %':>7} {'exclusive':>12} {'excl %':>7}"]
+        for name, incl, excl in self.table():
+            lines.append(f"{name:<24} {incl:>12} {100*incl/total:>6.1f}% {excl:>12} {100*excl/total:>6.1f}%")
+        return '\n'.join(lines)
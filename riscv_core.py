@@ -1,5 +1,10 @@
 # riscv_core.py
+import sys
+import time
+from array import array
 from riscv_defs import *
+from undo_log import UndoLog
+from metrics import METRICS
 
 def to_signed_32(value):
     """Converts a 32-bit unsigned value to a signed integer."""
@@ -13,42 +18,157 @@ def _sign_extend_12(value):
         return value - 0x1000
     return value
 
+# Reasons reported in RiscVCore.halt_reason once the core stops on its own
+HALT_NULL_INSTRUCTION = 'null_instruction'
+HALT_PC_FAULT = 'pc_out_of_range'
+HALT_IDLE = 'idle'
+
 class RiscVCore:
-    def __init__(self, mem_size=4096):
-        self.mem = bytearray(mem_size)
+    def __init__(self, mem_size=4096, detect_idle=True, mem=None):
+        self.mem = bytearray(mem_size) if mem is None else mem # mem: an existing writable buffer to use instead
         self.loaded_program_mc = [] # Store the initial machine code for resets
+        self.detect_idle = detect_idle # Stop on provably infinite loops (e.g. `j .`)
+        self.undo_log = None # Optional UndoLog for reverse execution, see enable_undo()
+        self.profiler = None # Set by CallStackProfiler.run() to observe calls and returns
         self.reset() # Call reset to initialize state
+        METRICS.track_core(self)
 
     def reset(self):
         """Resets the CPU state (PC, registers) and reloads program memory."""
+        start = time.perf_counter()
+        self._reset_state()
+        # Reload program into memory from our backup
+        self.load_program(self.loaded_program_mc)
+        METRICS.observe('reset_seconds', time.perf_counter() - start)
+
+    def _reset_state(self):
         self.regs = [0] * 32
         self.pc = 0
         self.cycles = 0
-        # Reload program into memory from our backup
-        self.load_program(self.loaded_program_mc)
+        self.halt_reason = None
+        self._idle_sig = None   # (branch pc, target pc, regs) at the last taken back-edge
+        self._mem_dirty = False # Set when a store changes memory since that back-edge
 
     def load_program(self, machine_code):
         """Loads machine code into memory and keeps a backup for resets."""
+        start = time.perf_counter()
         self.loaded_program_mc = machine_code
-        self.mem = bytearray(len(self.mem)) # Clear memory
+        self.mem[:] = bytes(len(self.mem)) # Clear memory in place so views from mem_words() stay valid
         for i, code in enumerate(machine_code):
             if code is not None:
                 self.mem[i*4:(i*4)+4] = code.to_bytes(4, 'little', signed=False)
+        if self.undo_log is not None: self.undo_log.clear(self) # Old history no longer matches memory
+        METRICS.observe('load_seconds', time.perf_counter() - start)
+
+    def _word_range(self, start, length):
+        """Clips [start, start+length) to guest memory, keeping whole words on the caller's word grid."""
+        end = len(self.mem) if length is None else min(len(self.mem), start + length)
+        if start < 0: start %= 4 # First in-bounds word of the requested grid
+        start = min(start, len(self.mem))
+        end = max(start, end)
+        return start, end - (end - start) % 4
+
+    def mem_words(self, start=0, length=None, signed=False):
+        """Returns guest memory [start, start+length) as a memoryview of 32-bit words.
+
+        The view shares the core's buffer, so reading it never copies; a
+        trailing partial word is left out. On big-endian hosts a byte-swapped
+        copy is returned instead, since a native cast would misread the words.
+        """
+        start, end = self._word_range(start, length)
+        view = memoryview(self.mem)[start:end]
+        fmt = 'i' if signed else 'I'
+        if sys.byteorder != 'little':
+            words = array(fmt, view.tobytes()); words.byteswap()
+            return memoryview(words)
+        return view.cast(fmt)
+
+    def mem_array(self, start=0, length=None, signed=False):
+        """Same as mem_words(), but as a NumPy array viewing guest memory (requires numpy)."""
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("mem_array() requires numpy: pip install numpy")
+        start, end = self._word_range(start, length)
+        count = (end - start) // 4
+        return np.frombuffer(self.mem, dtype='<i4' if signed else '<u4', count=count, offset=start)
+
+    def mem_snapshot(self):
+        """Returns an immutable copy of guest memory, for use with mem_diff()."""
+        return bytes(self.mem)
+
+    def mem_diff(self, old, new=None, chunk_size=4096):
+        """Lists the word-aligned (start, end) byte ranges where two memory images differ.
+
+        new defaults to the core's current memory; old is normally a
+        mem_snapshot() (other buffers are copied to bytes once). Chunks are
+        compared in place, and a changed chunk is halved until the differing
+        words are found, so unchanged memory costs no per-word objects.
+        Adjacent differing words are merged into a single range.
+        """
+        if chunk_size < 4 or chunk_size % 4: raise ValueError(f"chunk_size must be a positive multiple of 4, got {chunk_size}")
+        if not isinstance(old, (bytes, bytearray)): old = bytes(old)
+        view = memoryview(self.mem if new is None else new).cast('B')
+        size = min(len(old), len(view))
+        ranges = []
+
+        def scan(lo, hi):
+            if old.startswith(view[lo:hi], lo): return # memcmp against old at offset lo, no copy
+            if hi - lo <= 4:
+                if ranges and ranges[-1][1] == lo: ranges[-1] = (ranges[-1][0], hi)
+                else: ranges.append((lo, hi))
+                return
+            mid = lo + ((hi - lo) // 8 * 4 or 4) # Split on a word boundary
+            scan(lo, mid)
+            scan(mid, hi)
+
+        for base in range(0, size, chunk_size):
+            scan(base, min(base + chunk_size, size))
+        if len(old) != len(view):
+            ranges.append((size, max(len(old), len(view))))
+        return ranges
+
+    def enable_undo(self, max_bytes=4 * 1024 * 1024, checkpoint_interval=10000, max_checkpoints=16):
+        """Starts logging retired instructions so step_back() and run_back_to() can be used.
+
+        max_bytes bounds the log entries and memory checkpoints together.
+        """
+        self.undo_log = UndoLog(max_bytes, checkpoint_interval, max_checkpoints)
+        self.undo_log.clear(self)
+
+    def step_back(self, n=1):
+        """Reverses the last n retired instructions; returns how many were actually undone."""
+        if self.undo_log is None or n <= 0: return 0
+        undone = self.undo_log.rewind(self, n)
+        self.halt_reason = None
+        self._idle_sig, self._mem_dirty = None, False
+        return undone
+
+    def run_back_to(self, pc):
+        """Steps back to the most recent logged point where the PC was pc. Returns False if it is not in the log."""
+        distance = self.undo_log.distance_to(pc) if self.undo_log is not None else None
+        if distance is None: return False
+        self.step_back(distance)
+        return True
 
     def step(self):
         """Fetches, decodes, and executes a single instruction."""
         if not (0 <= self.pc < len(self.mem) and self.pc % 4 == 0):
+            self.halt_reason = HALT_PC_FAULT
             return False # Halt execution if PC is out of bounds or misaligned
 
         # 1. FETCH
         instr_mc = int.from_bytes(self.mem[self.pc : self.pc+4], 'little')
-        if instr_mc == 0: return False # Stop on null instruction (end of program)
+        if instr_mc == 0: # Stop on null instruction (end of program)
+            self.halt_reason = HALT_NULL_INSTRUCTION
+            return False
 
         # 2. DECODE
         opcode = instr_mc & OPCODE_MASK
         rd, rs1, rs2 = (instr_mc >> 7)&0x1F, (instr_mc >> 15)&0x1F, (instr_mc >> 20)&0x1F
         funct3, funct7 = (instr_mc >> 12)&0x7, (instr_mc >> 25)&0x7F
         next_pc = self.pc + 4
+        if self.undo_log is not None: self.undo_log.capture(self, instr_mc)
 
         # 3. EXECUTE
         if opcode == OPCODE_LUI:
@@ -81,13 +201,16 @@ class RiscVCore:
             addr = self.regs[rs1] + imm
             if funct3 == F3_SB:
                 if not (0 <= addr < len(self.mem)): return True
-                self.mem[addr] = self.regs[rs2] & 0xFF
+                val = self.regs[rs2] & 0xFF
+                if self.mem[addr] != val: self.mem[addr] = val; self._mem_dirty = True
             elif funct3 == F3_SH:
                 if not (0 <= addr < len(self.mem) - 1): return True
-                self.mem[addr:addr+2] = (self.regs[rs2] & 0xFFFF).to_bytes(2, 'little', signed=False)
+                data = (self.regs[rs2] & 0xFFFF).to_bytes(2, 'little', signed=False)
+                if self.mem[addr:addr+2] != data: self.mem[addr:addr+2] = data; self._mem_dirty = True
             elif funct3 == F3_SW:
                 if not (0 <= addr < len(self.mem) - 3): return True
-                self.mem[addr:addr+4] = (self.regs[rs2] & 0xFFFFFFFF).to_bytes(4, 'little', signed=False)
+                data = (self.regs[rs2] & 0xFFFFFFFF).to_bytes(4, 'little', signed=False)
+                if self.mem[addr:addr+4] != data: self.mem[addr:addr+4] = data; self._mem_dirty = True
         elif opcode == OPCODE_IMM:
             imm = _sign_extend_12(instr_mc >> 20)
             shamt = rs2
@@ -114,7 +237,8 @@ class RiscVCore:
             elif funct3 == F3_OR: self.regs[rd] = val1 | val2
             elif funct3 == F3_AND: self.regs[rd] = val1 & val2
         elif opcode == OPCODE_BRANCH:
-            imm = to_signed_32(((instr_mc&0x80000000)>>19) | ((instr_mc&0x80)<<4) | ((instr_mc>>20)&0x7e0) | ((instr_mc>>7)&0x1e))
+            imm = ((instr_mc&0x80000000)>>19) | ((instr_mc&0x80)<<4) | ((instr_mc>>20)&0x7e0) | ((instr_mc>>7)&0x1e)
+            if imm & 0x1000: imm -= 0x2000 # Sign-extend the 13-bit offset
             val1, val2 = self.regs[rs1], self.regs[rs2]
             branch_taken = (funct3 == F3_BEQ and val1 == val2) or \
                            (funct3 == F3_BNE and val1 != val2) or \
@@ -124,22 +248,59 @@ class RiscVCore:
                            (funct3 == F3_BGEU and (val1 & 0xFFFFFFFF) >= (val2 & 0xFFFFFFFF))
             if branch_taken: next_pc = self.pc + imm
         elif opcode == OPCODE_JAL:
-            imm = to_signed_32(((instr_mc&0x80000000)>>11) | (instr_mc&0xff000) | ((instr_mc>>9)&0x800) | ((instr_mc>>20)&0x7fe))
+            imm = ((instr_mc&0x80000000)>>11) | (instr_mc&0xff000) | ((instr_mc>>9)&0x800) | ((instr_mc>>20)&0x7fe)
+            if imm & 0x100000: imm -= 0x200000 # Sign-extend the 21-bit offset
             if rd != 0: self.regs[rd] = next_pc
             next_pc = self.pc + imm
+            if rd == 1 and self.profiler is not None: self.profiler.on_call(next_pc)
         elif opcode == OPCODE_JALR:
             imm = _sign_extend_12(instr_mc >> 20) # Corrected this to use 12-bit extension too
+            target = (self.regs[rs1] + imm) & ~1 # Read rs1 before rd is written, in case they are the same
             if rd != 0: self.regs[rd] = next_pc
-            next_pc = (self.regs[rs1] + imm) & ~1
+            next_pc = target
+            if self.profiler is not None:
+                if rd == 1: self.profiler.on_call(next_pc)
+                elif rd == 0 and rs1 == 1 and imm == 0: self.profiler.on_return()
 
         self.regs[0] = 0
+        # Only branches and jumps can move the PC backwards, so the idle check stays off the straight-line path
+        idle = next_pc <= self.pc and self.detect_idle and self._is_idle_loop(next_pc)
         self.pc = next_pc
         self.cycles += 1
+        if self.undo_log is not None: self.undo_log.commit(self)
+        if idle:
+            self.halt_reason = HALT_IDLE
+            return False # The instruction retired, but the core can never leave this loop
         return True # Indicate successful step
 
-    def run(self, max_cycles=5000):
-        """Continuously steps until the program ends or max_cycles is hit."""
-        start_cycles = self.cycles
+    def _is_idle_loop(self, next_pc):
+        """Checks a taken back-edge against the previous one.
+
+        If the same back-edge is taken twice with identical registers and no
+        memory change in between, the whole machine state repeats, so the
+        loop (including a plain `j .`) can never exit.
+        """
+        sig = (self.pc, next_pc, tuple(self.regs))
+        idle = sig == self._idle_sig and not self._mem_dirty
+        self._idle_sig = sig
+        self._mem_dirty = False
+        return idle
+
+    def run(self, max_cycles=5000, fast_forward=False):
+        """Continuously steps until the program ends or max_cycles is hit.
+
+        Returns halt_reason, or None if the cycle budget ran out first. With
+        fast_forward, an idle halt advances cycles as if the loop had spun
+        for the rest of the budget.
+        """
+        start_cycles, start_time = self.cycles, time.perf_counter()
         while (self.cycles - start_cycles) < max_cycles:
             if not self.step():
-                break # Stop if step() indicates the program is done
\ No newline at end of file
+                break # Stop if step() indicates the program is done
+        METRICS.record_run(self.cycles - start_cycles, time.perf_counter() - start_time) # Once per run, never per step
+        if fast_forward and self.halt_reason == HALT_IDLE:
+            skipped = start_cycles + max_cycles - self.cycles
+            if skipped > 0:
+                if self.undo_log is not None: self.undo_log.record_skip(self, skipped)
+                self.cycles += skipped
+        return self.halt_reason
\ No newline at end of file
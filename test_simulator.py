@@ -0,0 +1,180 @@
+# test_simulator.py
+import json
+import multiprocessing as mp
+import os
+import pytest
+import multi_hart
+from assembler import parse_assembly
+from riscv_core import RiscVCore, HALT_IDLE, HALT_NULL_INSTRUCTION
+from profiler import CallStackProfiler
+from multi_hart import MultiHartSystem
+from metrics import Metrics
+
+def load(source, **core_args):
+    program, _ = parse_assembly(source)
+    core = RiscVCore(**core_args)
+    core.load_program(program['machine_code'])
+    return core
+
+def test_step_back_past_log_lands_on_exact_cycle():
+    # The store changes memory every iteration, so replay from a checkpoint must not report an idle halt
+    core = load("loop:\nlw t0, 512(x0)\naddi t0, t0, 1\nsw t0, 512(x0)\naddi t0, x0, 0\nj loop", mem_size=1024)
+    core.enable_undo(max_bytes=2 * 22*200, checkpoint_interval=97) # 200 entries + four 1 KiB checkpoints
+    core.run(2000)
+    assert core.step_back(300) == 300
+    assert core.cycles == 1700
+    assert core.halt_reason is None
+
+def test_undo_log_stays_within_max_bytes():
+    core = load("loop:\nsw t0, 512(x0)\naddi t0, t0, 1\nj loop", mem_size=1024)
+    core.enable_undo(max_bytes=8 * 1024, checkpoint_interval=10)
+    core.run(5000)
+    assert 0 < core.undo_log.nbytes <= 8 * 1024
+
+def test_mem_words_clips_to_requested_range():
+    core = load("addi t0, x0, 1\naddi t1, x0, 2")
+    assert len(core.mem_words(-8, 8)) == 0
+    assert list(core.mem_words(-4, 12)) == [0x00100293, 0x00200313]
+    assert len(core.mem_words(len(core.mem) + 16, 8)) == 0
+
+def test_step_back_without_older_checkpoint_stops_at_oldest_entry():
+    core = load("loop:\naddi t0, t0, 1\nj loop", mem_size=64)
+    core.enable_undo(max_bytes=2200, checkpoint_interval=10, max_checkpoints=2)
+    core.run(100)
+    oldest = core.cycles - len(core.undo_log)
+    assert core.step_back(len(core.undo_log) + 5) == 100 - oldest
+    assert core.cycles == oldest
+    core.run(10)
+    assert core.step_back(10) == 10
+    assert core.cycles == oldest
+
+def test_step_back_over_fast_forward_undoes_at_most_n():
+    core = load("addi t0, x0, 1\nloop:\nj loop")
+    core.enable_undo()
+    assert core.run(100000, fast_forward=True) == 'idle'
+    assert core.cycles == 100000
+    assert core.step_back(1) == 1
+    assert core.cycles == 3
+    assert core.step_back(10) == 3
+    assert core.cycles == 0
+
+def test_profiler_attributes_cycles_to_call_stack():
+    source = "main:\nli s1, 3\nouter:\njal ra, leaf\naddi s1, s1, -1\nbne s1, zero, outer\ndone:\nj done\nleaf:\nli t1, 5\nl1:\naddi t1, t1, -1\nbne t1, zero, l1\nret"
+    program, _ = parse_assembly(source)
+    core = RiscVCore()
+    core.load_program(program['machine_code'])
+    profiler = CallStackProfiler(program['symbols'], interval=1)
+    assert profiler.run(core, 1000) == 'idle'
+    rows = {name: (incl, excl) for name, incl, excl in profiler.table()}
+    assert rows['main'][0] == core.cycles
+    assert rows['leaf'] == (3 * 12, 3 * 12) # jal + li + 5 * (addi, bne) per call; ret is sampled back in main
+    assert "main;leaf 36\n" in profiler.collapsed()
+
+def test_profiler_rejects_non_positive_interval():
+    with pytest.raises(ValueError):
+        CallStackProfiler(interval=0)
+
+def test_mem_diff_reports_merged_word_ranges():
+    core = RiscVCore(mem_size=4096)
+    snapshot = core.mem_snapshot()
+    core.mem[6] = 1
+    core.mem[8:16] = b'\xff' * 8
+    core.mem[4095] = 2
+    assert core.mem_diff(snapshot, chunk_size=8) == [(4, 16), (4092, 4096)]
+    assert core.mem_diff(snapshot) == core.mem_diff(snapshot, chunk_size=4)
+    assert core.mem_diff(core.mem_snapshot()) == []
+    with pytest.raises(ValueError):
+        core.mem_diff(snapshot, chunk_size=6)
+
+def test_self_jump_halts_idle():
+    core = load("addi t0, x0, 5\nloop:\nj loop")
+    assert core.run(5000) == HALT_IDLE
+    assert core.cycles < 5
+
+def test_spin_on_unchanged_memory_halts_idle():
+    core = load("spin:\nlw t1, 512(x0)\nbeq t1, x0, spin")
+    assert core.run(5000) == HALT_IDLE
+
+def test_counting_loop_runs_to_end():
+    # Backward bne and j offsets must sign-extend for the loop to close
+    core = load("li t0, 3\nloop:\naddi t0, t0, -1\nbeq t0, x0, out\nj loop\nout:\naddi t1, x0, 1")
+    assert core.run(5000) == HALT_NULL_INSTRUCTION
+    assert core.regs[5:7] == [0, 1]
+    core = load("li t0, 3\nloop:\naddi t0, t0, -1\nbne t0, x0, loop\naddi t1, x0, 1")
+    assert core.run(5000) == HALT_NULL_INSTRUCTION
+    assert core.cycles == 1 + 3 * 2 + 1
+
+def test_loop_that_changes_memory_is_not_idle():
+    core = load("loop:\nlw t0, 512(x0)\naddi t0, t0, 1\nsw t0, 512(x0)\naddi t0, x0, 0\nj loop")
+    assert core.run(2000) is None
+    assert core.cycles == 2000
+
+def test_fast_forward_fills_cycle_budget():
+    core = load("loop:\nj loop")
+    assert core.run(1000, fast_forward=True) == HALT_IDLE
+    assert core.cycles == 1000
+    core = load("loop:\nj loop")
+    core.run(1000)
+    assert core.cycles == 2
+
+# Each hart adds its id + 1 into its own word and into a shared counter, then stores sp
+HART_PROGRAM = "slli t0, a0, 2\naddi t1, a0, 1\nlw t2, 512(t0)\nadd t2, t2, t1\nsw t2, 512(t0)\nlw t3, 600(zero)\nadd t3, t3, t1\nsw t3, 600(zero)\nsw sp, 700(t0)"
+
+@pytest.mark.parametrize('deterministic', [False, True])
+def test_two_harts_share_memory(deterministic):
+    program, _ = parse_assembly(HART_PROGRAM)
+    with MultiHartSystem(num_harts=2, mem_size=1024) as system:
+        system.load_program(program['machine_code'])
+        results = system.run(max_cycles=100, quantum=1, deterministic=deterministic, stack_top=1000, stack_size=100)
+        words = system.mem.cast('I').tolist()
+        assert [r['halt_reason'] for r in results] == [HALT_NULL_INSTRUCTION] * 2
+        assert [r['regs'][10] for r in results] == [0, 1] # a0 carries the hart id
+        assert list(words[128:130]) == [1, 2]
+        assert list(words[175:177]) == [1000, 900]
+        if deterministic: # Lockstep turns lose hart 0's counter update the same way every run
+            assert words[150] == 2
+            system.reset()
+            system.run(max_cycles=100, quantum=1, deterministic=True, stack_top=1000, stack_size=100)
+            assert system.mem.cast('I').tolist() == words
+
+def test_multi_hart_crashed_worker_raises(monkeypatch):
+    if mp.get_start_method() != 'fork': pytest.skip("needs fork to patch the worker")
+    worker = multi_hart._hart_worker
+    def crash_hart_one(*args):
+        if args[2] == 1: os._exit(3) # args[2] is the hart id
+        worker(*args)
+    monkeypatch.setattr(multi_hart, '_hart_worker', crash_hart_one)
+    program, _ = parse_assembly("loop:\nj loop")
+    with MultiHartSystem(num_harts=2, mem_size=256) as system:
+        system.load_program(program['machine_code'])
+        with pytest.raises(RuntimeError):
+            system.run(max_cycles=10**9, quantum=10)
+
+def test_multi_hart_rejects_bad_arguments_and_use_after_close():
+    system = MultiHartSystem(num_harts=1, mem_size=256)
+    with pytest.raises(ValueError):
+        system.run(quantum=0)
+    system.close()
+    with pytest.raises(ValueError):
+        system.run()
+    with pytest.raises(ValueError):
+        MultiHartSystem(num_harts=0)
+
+def test_metrics_export_formats():
+    metrics = Metrics()
+    core = RiscVCore(mem_size=256)
+    metrics.track_core(core)
+    metrics.record_run(100, 0.5)
+    metrics.record_steps(3)
+    metrics.observe('reset_seconds', 0.002)
+    snapshot = json.loads(metrics.to_json())
+    assert snapshot['counters']['instructions_retired_total'] == 103
+    assert snapshot['gauges']['instructions_per_second'] == 200
+    assert snapshot['gauges']['core_memory_bytes'] == {'0': 256}
+    assert snapshot['histograms']['reset_seconds']['buckets']['0.005'] == 1
+    text = metrics.to_prometheus()
+    assert "# TYPE riscv_instructions_retired_total counter\nriscv_instructions_retired_total 103\n" in text
+    assert 'riscv_core_memory_bytes{core="0"} 256\n' in text
+    assert 'riscv_reset_seconds_bucket{le="0.001"} 0\n' in text
+    assert 'riscv_reset_seconds_bucket{le="+Inf"} 1\n' in text
+    assert "riscv_reset_seconds_count 1\n" in text
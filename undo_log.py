@@ -0,0 +1,140 @@
+# undo_log.py
+# Bounded reverse-execution log for RiscVCore (see RiscVCore.enable_undo).
+from array import array
+from metrics import METRICS
+
+class UndoLog:
+    """Records how to undo each retired instruction, in compact parallel arrays.
+
+    Every entry holds the PC before the instruction, the destination register
+    and its old value, and for stores the address, width and old bytes. Full
+    checkpoints (PC, registers, memory copy) are taken every
+    checkpoint_interval cycles so that stepping back past the start of the log
+    only replays from the nearest checkpoint instead of from cycle zero.
+
+    max_bytes caps both: checkpoints may use up to half of it (oldest dropped
+    first, and none kept if one memory copy alone is too big), and the
+    entries the other half (oldest quarter dropped when full).
+    """
+    # pc (I) + rd (B) + old rd value (q) + store addr (i) + store size (B) + old store bytes (I)
+    ENTRY_BYTES = 4 + 1 + 8 + 4 + 1 + 4
+    SKIP_RD = 0xFF # rd marker for a fast-forward entry; its rd value holds the skipped cycles
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, checkpoint_interval=10000, max_checkpoints=16):
+        self.max_checkpoint_bytes = max_bytes // 2
+        self.max_entries = max(1, (max_bytes - self.max_checkpoint_bytes) // self.ENTRY_BYTES)
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.checkpoints = [] # (cycles, pc, regs, memory bytes), oldest first
+        self._clear_entries()
+        self._pending = (0, 0, 0, -1, 0, 0)
+
+    def _clear_entries(self):
+        self.pcs, self.rds, self.rd_vals = array('I'), array('B'), array('q')
+        self.mem_addrs, self.mem_sizes, self.mem_vals = array('i'), array('B'), array('I')
+
+    def __len__(self):
+        return len(self.pcs)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the log and its checkpoints."""
+        return len(self.pcs) * self.ENTRY_BYTES + sum(len(cp[3]) for cp in self.checkpoints)
+
+    def clear(self, core):
+        """Drops all history and checkpoints the core's current state."""
+        self._clear_entries()
+        self.checkpoints = []
+        self.checkpoint(core)
+
+    def checkpoint(self, core):
+        if len(core.mem) > self.max_checkpoint_bytes: return # Would never fit in the budget
+        self.checkpoints.append((core.cycles, core.pc, list(core.regs), bytes(core.mem)))
+        while (len(self.checkpoints) > self.max_checkpoints
+               or sum(len(cp[3]) for cp in self.checkpoints) > self.max_checkpoint_bytes):
+            del self.checkpoints[0]
+
+    def capture(self, core, instr_mc):
+        """Remembers the state an instruction is about to overwrite (called before execute)."""
+        rd = (instr_mc >> 7) & 0x1F
+        addr, size, old = -1, 0, 0
+        if instr_mc & 0x7F == 0b0100011: # Store: save the bytes it may overwrite
+            imm = ((instr_mc >> 25) << 5) | rd
+            if imm & 0x800: imm -= 0x1000
+            addr = core.regs[(instr_mc >> 15) & 0x1F] + imm
+            if 0 <= addr < len(core.mem):
+                old_bytes = bytes(core.mem[addr:addr + (1 << ((instr_mc >> 12) & 0x3))])
+                size, old = len(old_bytes), int.from_bytes(old_bytes, 'little')
+            else:
+                addr = -1
+        self._pending = (core.pc, rd, core.regs[rd], addr, size, old)
+
+    def commit(self, core):
+        """Appends the captured entry once the instruction has retired."""
+        pc, rd, rd_val, addr, size, old = self._pending
+        self._append(pc, rd, rd_val, addr, size, old)
+        if self.checkpoint_interval and core.cycles % self.checkpoint_interval == 0:
+            self.checkpoint(core)
+
+    def record_skip(self, core, cycles):
+        """Logs cycles skipped by RiscVCore.run(fast_forward=True) as a single entry."""
+        self._append(core.pc, self.SKIP_RD, cycles, -1, 0, 0)
+
+    def _append(self, pc, rd, rd_val, addr, size, old):
+        self.pcs.append(pc); self.rds.append(rd); self.rd_vals.append(rd_val)
+        self.mem_addrs.append(addr); self.mem_sizes.append(size); self.mem_vals.append(old)
+        if len(self.pcs) > self.max_entries:
+            drop = max(1, self.max_entries // 4)
+            for arr in (self.pcs, self.rds, self.rd_vals, self.mem_addrs, self.mem_sizes, self.mem_vals):
+                del arr[:drop]
+
+    def _undo_one(self, core):
+        addr, size, old = self.mem_addrs.pop(), self.mem_sizes.pop(), self.mem_vals.pop()
+        if addr >= 0:
+            core.mem[addr:addr+size] = old.to_bytes(size, 'little')
+        rd, rd_val = self.rds.pop(), self.rd_vals.pop()
+        core.pc = self.pcs.pop()
+        if rd == self.SKIP_RD:
+            core.cycles -= rd_val
+        else:
+            core.regs[rd] = rd_val
+            core.cycles -= 1
+
+    def rewind(self, core, n):
+        """Moves the core back n retired instructions; returns how many were undone (at most n).
+
+        Within the log this costs O(n). Beyond it, the nearest checkpoint at or
+        before the target is restored and execution replayed forward from there.
+        With no such checkpoint the core stops at the oldest logged entry.
+        A fast-forward entry counts as one instruction.
+        """
+        undone = 0
+        while self.pcs and undone < n:
+            self._undo_one(core)
+            undone += 1
+        target = core.cycles - (n - undone)
+        earlier = [cp for cp in self.checkpoints if cp[0] <= target] if undone < n else []
+        if earlier: # Never restore a checkpoint newer than the target: that would move forward
+            cycles, pc, regs, mem = earlier[-1]
+            core.mem[:] = mem
+            core.regs, core.pc, core.cycles = list(regs), pc, cycles
+            self._clear_entries()
+            self._drop_checkpoints_after(cycles)
+            # Idle tracking from before the rewind doesn't describe the restored state; start it afresh
+            core._idle_sig, core._mem_dirty = None, True
+            while core.cycles < target and core.step(): pass
+            METRICS.record_steps(core.cycles - cycles)
+            undone = min(n, n - (core.cycles - target))
+        self._drop_checkpoints_after(core.cycles)
+        return undone
+
+    def _drop_checkpoints_after(self, cycles):
+        # Checkpoints past the current point get retaken on the way forward again
+        while self.checkpoints and self.checkpoints[-1][0] > cycles:
+            self.checkpoints.pop()
+
+    def distance_to(self, pc):
+        """Number of steps back to the most recent logged point where the PC was pc, or None."""
+        for back, logged_pc in enumerate(reversed(self.pcs), 1):
+            if logged_pc == pc: return back
+        return None